@@ -13,8 +13,12 @@ Lanceur de commandes PowerShell avec interface graphique (Windows 11) sxsxs
 - Blocage des opérations tant qu'une commande est en cours
 - Coloration syntaxique Markdown/Quarto dans la vue fichier
 """
+import bisect
+import codecs
+import functools
+import io
 import json
-import queue
+import os
 import re
 import subprocess
 import sys
@@ -26,6 +30,74 @@ from tkinter import ttk, filedialog, messagebox
 
 APP_TITLE = "Lanceur de commandes PowerShell"
 CONFIG_FILE = Path(__file__).with_name("commands.json")
+# Au-delà de cette taille, seule la zone visible du fichier est colorée
+MD_HIGHLIGHT_MAX_CHARS = 512 * 1024
+
+# Expressions de coloration Markdown/Quarto, compilées une seule fois
+_MD_PATTERNS = {
+    "newline": re.compile(r"\n"),
+    "heading": re.compile(r"(?m)^(#{1,6})\s.*$"),
+    "code_inline": re.compile(r"(?s)(?<!`)`([^`\n]|``(?!`))*?`"),
+    "link": re.compile(r"\[([^\]]+)\]\(([^)]+)\)"),
+    "setext": re.compile(r"(?ms)^(?P<title>[^\n]+)\n(=+|-+)\s*$"),
+}
+
+def _tokenize_emphasis(content: str, code_ranges=()):
+    """Repère **gras**/__gras__ et *italique*/_italique_ en un seul passage linéaire.
+
+    Produit des tuples (tag, début, fin). Les plages de `code_ranges` (code
+    inline et blocs) sont sautées. L'italique ne traverse pas les fins de
+    ligne, le gras s'arrête à une ligne vide, et `_` n'agit pas dans un mot.
+    Une série `***`/`___` ouvre ou ferme à la fois le gras et l'italique.
+    """
+    ranges = sorted(code_ranges)
+    k = 0
+    n = len(content)
+    bold_open = {"*": None, "_": None}
+    italic_open = {"*": None, "_": None}
+    i = 0
+    while i < n:
+        # Sauter le code
+        while k < len(ranges) and ranges[k][1] <= i:
+            k += 1
+        if k < len(ranges) and ranges[k][0] <= i:
+            i = ranges[k][1]
+            continue
+        c = content[i]
+        if c == "\n":
+            italic_open["*"] = italic_open["_"] = None
+            if i + 1 < n and content[i + 1] == "\n":
+                bold_open["*"] = bold_open["_"] = None
+            i += 1
+            continue
+        if c != "*" and c != "_":
+            i += 1
+            continue
+        j = i
+        while j < n and content[j] == c:
+            j += 1
+        run = j - i
+        # Ouverture suivie d'un caractère non blanc, fermeture précédée d'un non blanc
+        opens = j < n and not content[j].isspace()
+        closes = i > 0 and not content[i - 1].isspace()
+        if c == "_":
+            # Pas d'emphase au milieu d'un mot (snake_case)
+            opens = opens and not (i > 0 and content[i - 1].isalnum())
+            closes = closes and not (j < n and content[j].isalnum())
+        # Une série de 3 (***x***) compte à la fois pour le gras et l'italique
+        if run in (1, 3):
+            if italic_open[c] is not None and closes:
+                yield "md_italic", italic_open[c], j
+                italic_open[c] = None
+            elif opens:
+                italic_open[c] = i
+        if run in (2, 3):
+            if bold_open[c] is not None and closes:
+                yield "md_bold", bold_open[c], j
+                bold_open[c] = None
+            elif opens:
+                bold_open[c] = i
+        i = j
 
 @dataclass
 class CommandItem:
@@ -37,25 +109,87 @@ class CommandModel:
     def __init__(self):
         self.items: list[CommandItem] = []
         self.cwd: str | None = None
+        self._last_serialized: bytes | None = None
+        # Sauvegarde en arrière-plan : save() dépose un instantané, le thread l'écrit
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending_payload: tuple[int, dict] | None = None
+        self._save_pending = threading.Event()
+        # Suivi des écritures : dernier numéro demandé, dernier traité, dernière erreur
+        self.save_seq = 0
+        self._done_seq = 0
+        self._save_error: Exception | None = None
+        threading.Thread(target=self._save_worker, daemon=True).start()
 
     def load(self):
         if CONFIG_FILE.exists():
             try:
-                data = json.loads(CONFIG_FILE.read_text(encoding="utf-8"))
+                raw = CONFIG_FILE.read_bytes()
+                data = json.loads(raw.decode("utf-8"))
                 self.cwd = data.get("cwd")
                 self.items = [CommandItem(**it) for it in data.get("items", [])]
+                self._last_serialized = raw
             except Exception as e:
                 messagebox.showwarning(APP_TITLE, f"Impossible de lire {CONFIG_FILE}: {e}\nUn nouveau fichier sera créé.")
                 self._write_default()
         else:
             self._write_default()
 
-    def save(self):
+    def save(self) -> int:
+        """Demande une sauvegarde ; renvoie son numéro (voir is_saved)."""
         payload = {
             "cwd": self.cwd,
             "items": [asdict(it) for it in self.items],
         }
-        CONFIG_FILE.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+        with self._lock:
+            self.save_seq += 1
+            self._pending_payload = (self.save_seq, payload)
+        self._save_pending.set()
+        return self.save_seq
+
+    def is_saved(self, seq: int) -> bool:
+        """Vrai une fois la sauvegarde `seq` (ou une plus récente) traitée."""
+        with self._lock:
+            return self._done_seq >= seq
+
+    def take_save_error(self) -> Exception | None:
+        """Renvoie puis efface la dernière erreur d'écriture."""
+        with self._lock:
+            err, self._save_error = self._save_error, None
+        return err
+
+    def flush(self):
+        """Écrit immédiatement la sauvegarde en attente (à la fermeture)."""
+        self._write_pending()
+
+    def _save_worker(self):
+        while True:
+            self._save_pending.wait()
+            self._save_pending.clear()
+            self._write_pending()
+
+    def _write_pending(self):
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending_payload = self._pending_payload, None
+            if pending is None:
+                return
+            seq, payload = pending
+            error = None
+            try:
+                payload_bytes = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+                if payload_bytes != self._last_serialized:
+                    # Écriture atomique : fichier temporaire puis remplacement
+                    tmp = CONFIG_FILE.with_name(CONFIG_FILE.name + ".tmp")
+                    tmp.write_bytes(payload_bytes)
+                    os.replace(tmp, CONFIG_FILE)
+                    self._last_serialized = payload_bytes
+            except Exception as e:
+                error = e
+            with self._lock:
+                if error is not None:
+                    self._save_error = error
+                self._done_seq = seq
 
     def _write_default(self):
         self.items = [
@@ -70,61 +204,117 @@ class PSRunner:
     def __init__(self, output_callback, on_exit):
         self.proc: subprocess.Popen | None = None
         self.thread: threading.Thread | None = None
-        self.queue = queue.Queue()
         self.output_callback = output_callback
         self.on_exit = on_exit
-        self._stop_reader = threading.Event()
+        # Numéro de l'exécution courante : les sorties d'une exécution précédente
+        # (pipe encore tenu ouvert par un processus enfant) sont ignorées
+        self._run_id = 0
 
-    def run(self, command: str, cwd: str | None):
+    def run(self, command: str, cwd: str | None) -> bool:
+        """Lance la commande ; renvoie False si PowerShell n'a pas pu démarrer."""
         if self.is_running:
             raise RuntimeError("Un processus est déjà en cours.")
-        ps_cmd = ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command", command]
+        # Sortie console en UTF-8 (sans BOM) quelle que soit la page de code locale
+        ps_cmd = [
+            "powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command",
+            "[Console]::OutputEncoding = New-Object System.Text.UTF8Encoding $false; " + command,
+        ]
+        popen_kwargs = {}
+        if sys.platform.startswith("win"):
+            # Pas de console attachée : lancement plus rapide, sans fenêtre qui clignote
+            si = subprocess.STARTUPINFO()
+            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            si.wShowWindow = subprocess.SW_HIDE
+            popen_kwargs["startupinfo"] = si
+            popen_kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
         try:
             self.proc = subprocess.Popen(
                 ps_cmd,
                 cwd=cwd or None,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if sys.platform.startswith("win") else 0,
+                env={**os.environ, "PYTHONIOENCODING": "utf-8"},
+                **popen_kwargs,
             )
         except FileNotFoundError:
             messagebox.showerror(APP_TITLE, "PowerShell introuvable. Assurez-vous d'être sous Windows avec PowerShell dans le PATH.")
             self.proc = None
-            return
-        self._stop_reader.clear()
-        self.thread = threading.Thread(target=self._reader, daemon=True)
-        self.thread.start()
-        self._pump_output()
+            return False
+        self._run_id += 1
+        # Lecture binaire par blocs, décodage incrémental (UTF-8 + fins de ligne)
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder("utf-8")(errors="replace"),
+            translate=True,
+        )
+        if sys.platform.startswith("win"):
+            # Les pipes Windows ne sont pas pris en charge par createfilehandler :
+            # lecture dans un thread dédié
+            self.thread = threading.Thread(
+                target=self._reader,
+                args=(self._run_id, self.proc, self.proc.stdout.fileno(), decoder),
+                daemon=True,
+            )
+            self.thread.start()
+        else:
+            # POSIX : le notifier Tk réveille la boucle dès que le pipe est lisible.
+            # Le gestionnaire est lié à cette exécution (processus, décodeur).
+            os.set_blocking(self.proc.stdout.fileno(), False)
+            root.tk.createfilehandler(
+                self.proc.stdout,
+                tk.READABLE,
+                functools.partial(self._on_readable, self._run_id, self.proc, decoder),
+            )
+        return True
 
     @property
     def is_running(self) -> bool:
         return self.proc is not None and self.proc.poll() is None
 
-    def _reader(self):
-        assert self.proc is not None
-        for line in self.proc.stdout:
-            if self._stop_reader.is_set():
-                break
-            self.queue.put(line)
-        self.queue.put(None)
-
-    def _pump_output(self):
+    def _reader(self, run_id: int, proc: subprocess.Popen, fd: int, decoder):
+        # Thread de lecture : chaque bloc est remis au thread Tk par after_idle,
+        # sans file intermédiaire ni relève périodique. Suppose un Tcl compilé
+        # avec les threads (cas des builds CPython) : tkinter relaie alors
+        # l'appel vers la boucle principale. L'état de l'exécution est passé en
+        # argument : un thread resté ouvert après Arrêter ne touche pas la suivante.
         try:
             while True:
-                item = self.queue.get_nowait()
-                if item is None:
-                    self.output_callback("\n[Processus terminé]\n")
-                    self.on_exit()
-                    return
-                else:
-                    self.output_callback(item)
-        except queue.Empty:
+                data = os.read(fd, 65536)
+                if not data:
+                    break
+                text = decoder.decode(data)
+                if text:
+                    root.after_idle(self._deliver, run_id, text)
+            root.after_idle(self._deliver, run_id, decoder.decode(b"", final=True))
+            root.after_idle(self._finish, run_id, proc)
+        except (RuntimeError, tk.TclError):
+            # Fenêtre fermée pendant l'exécution
             pass
-        if self.is_running or not self.queue.empty():
-            root.after(50, self._pump_output)
+
+    def _on_readable(self, run_id: int, proc: subprocess.Popen, decoder, _file, _mask):
+        try:
+            data = os.read(proc.stdout.fileno(), 65536)
+        except BlockingIOError:
+            return
+        if data:
+            self._deliver(run_id, decoder.decode(data))
+            return
+        root.tk.deletefilehandler(proc.stdout)
+        self._deliver(run_id, decoder.decode(b"", final=True))
+        self._finish(run_id, proc)
+
+    def _deliver(self, run_id: int, text: str):
+        if text and run_id == self._run_id:
+            self.output_callback(text)
+
+    def _finish(self, run_id: int, proc: subprocess.Popen):
+        if run_id != self._run_id:
+            return
+        # Fin du pipe : attendre la fin du processus sans bloquer la boucle Tk
+        if proc.poll() is None:
+            root.after(50, self._finish, run_id, proc)
+            return
+        self.output_callback("\n[Processus terminé]\n")
+        self.on_exit()
 
     def stop(self):
         if self.is_running and self.proc is not None:
@@ -132,7 +322,9 @@ class PSRunner:
                 self.proc.terminate()
             except Exception:
                 pass
-        self._stop_reader.set()
+        # Seul PowerShell est arrêté : un processus enfant peut garder le pipe
+        # ouvert. Sa lecture continue jusqu'à la fin du pipe, et sa sortie est
+        # ignorée dès qu'une nouvelle exécution est lancée (voir _run_id).
 
 class App(ttk.Frame):
     def __init__(self, master, model: CommandModel):
@@ -141,10 +333,21 @@ class App(ttk.Frame):
         self.runner = PSRunner(self.append_output, self.on_process_exit)
         self.prog_running = False
         self._opened_file_path: Path | None = None
+        self._md_viewport_mode = False
+        self._md_viewport_job: str | None = None
+        self._md_viewport_range: tuple[int, int] | None = None
+        self._lineno_pending = False
+        self._last_line_count = 0
+        self._edit_dialog: tk.Toplevel | None = None
+        self._edit_idx: int | None = None
+        self._last_running_state: bool | None = None
+        self._see_pending = False
         self._build_ui()
         self._set_output_file(None)
-        self._refresh_list()
+        self._full_refresh()
         self.set_status()
+        # Erreur éventuelle de la sauvegarde faite au chargement
+        self._watch_save(self.model.save_seq)
 
         # === Blocage global des événements de la Listbox pendant l'exécution ===
         self.listbox.bind("<Button>", self._block_events_when_running, add="+")
@@ -340,13 +543,21 @@ class App(ttk.Frame):
                 messagebox.showerror(APP_TITLE, f"Impossible de lire le fichier: {e}")
                 return
 
+        self._md_viewport_mode = False
         self.text.delete("1.0", tk.END)
         self.text.insert(tk.END, content)
+        self.text.edit_reset()
         self.text.see(tk.END)
 
         # Coloration syntaxique si fichier Markdown/Quarto
         if path.suffix.lower() in {".qmd", ".md", ".markdown"}:
-            self._apply_markdown_highlighting(content)
+            if len(content) > MD_HIGHLIGHT_MAX_CHARS:
+                # Gros fichier : coloration limitée à la zone visible, mise à jour au défilement
+                self._md_viewport_mode = True
+                self._md_viewport_range = None
+                self._schedule_viewport_highlighting()
+            else:
+                self._apply_markdown_highlighting(content)
             if path.suffix.lower() == ".qmd":
                 self._set_output_file(path)
             else:
@@ -357,100 +568,192 @@ class App(ttk.Frame):
         self.set_status(f"Fichier ouvert: {path}")
 
     # --- Coloration Markdown/Quarto (simple, basée regex)
-    def _apply_markdown_highlighting(self, content: str):
-        # Nettoyer tags existants
+    def _apply_markdown_highlighting(self, content: str, first_line: int = 1, in_fence: bool = False):
+        """Colore `content`, qui commence à la ligne `first_line` du widget.
+
+        `in_fence` indique que `content` commence à l'intérieur d'un bloc de code.
+        """
+        # Historique d'annulation suspendu pendant la passe, puis rétabli tel quel
+        undo = self.text.cget("undo")
+        autoseparators = self.text.cget("autoseparators")
+        self.text.config(undo=False, autoseparators=False)
+        try:
+            self._tag_markdown(content, first_line, in_fence)
+        finally:
+            self.text.config(undo=undo, autoseparators=autoseparators)
+
+    def _tag_markdown(self, content: str, first_line: int, in_fence: bool):
+        # Positions des sauts de ligne : conversion offset -> "ligne.colonne"
+        # sans que Tk ait à recompter les caractères depuis "1.0"
+        nl = [-1]
+        nl.extend(m.start() for m in _MD_PATTERNS["newline"].finditer(content))
+
+        def idx(pos: int) -> str:
+            line = bisect.bisect_right(nl, pos - 1)
+            return f"{line + first_line - 1}.{pos - nl[line - 1] - 1}"
+
+        # Nettoyer tags existants sur la zone traitée
+        last_line = first_line + len(nl) - 1
         for tag in self.text.tag_names():
             if tag.startswith("md_"):
-                self.text.tag_remove(tag, "1.0", tk.END)
+                self.text.tag_remove(tag, f"{first_line}.0", f"{last_line}.end")
 
-        def idx(pos: int) -> str:
-            return f"1.0+{pos}c"
+        # Plages regroupées par tag : un seul tag_add par tag en fin de passe
+        ranges: dict[str, list[str]] = {}
 
-        # Titres ATX : ^#{1,6} .*
-        for m in re.finditer(r"(?m)^(#{1,6})\s.*$", content):
-            self.text.tag_add("md_heading", idx(m.start()), idx(m.end()))
+        def add(tag: str, start: int, end: int):
+            ranges.setdefault(tag, []).extend((idx(start), idx(end)))
 
-        # Règles horizontales: lignes de --- ___ ***
-        for m in re.finditer(r"(?m)^(?:-{3,}|_{3,}|\*{3,})\s*$", content):
-            self.text.tag_add("md_hr", idx(m.start()), idx(m.end()))
+        # Titres ATX : ^#{1,6} .*
+        for m in _MD_PATTERNS["heading"].finditer(content):
+            add("md_heading", m.start(), m.end())
 
         # YAML front matter au début: --- ... ---
-        fm = re.match(r"(?s)^---\n.*?\n---\s*\n", content)
-        if fm:
-            self.text.tag_add("md_yaml", idx(fm.start()), idx(fm.end()))
+        if first_line == 1 and content.startswith(("---\n", "---\r\n")):
+            close = content.find("\n---", 3)
+            while close != -1:
+                eol = content.find("\n", close + 4)
+                stop = len(content) if eol == -1 else eol
+                if not content[close + 4:stop].strip():
+                    add("md_yaml", 0, min(stop + 1, len(content)))
+                    break
+                close = content.find("\n---", close + 4)
+
+        # Plages de code, exclues de la recherche du gras/italique
+        code_ranges: list[tuple[int, int]] = []
 
         # Fenced code blocks (Markdown + Quarto): ```lang / ```{lang} ... ```
-        for m in re.finditer(r"(?s)```{[^}\n]+}\s*\n.*?\n```|```[^\n]*\n.*?\n```", content):
-            # Lignes de fence
-            # début
-            fence_open = re.match(r"```[^\n]*\n", content[m.start():])
-            if fence_open:
-                self.text.tag_add("md_code_fence", idx(m.start()), idx(m.start() + fence_open.end()))
-                # Marquer Quarto {..}
-                if "{" in fence_open.group(0):
-                    self.text.tag_add("md_quarto", idx(m.start()), idx(m.start() + fence_open.end()))
-            # fin
-            self.text.tag_add("md_code_fence", idx(m.end()-4), idx(m.end()))
-            # contenu
-            body_start = m.start() + (fence_open.end() if fence_open else 0)
-            body_end = m.end() - 3  # exclude trailing ```
-            self.text.tag_add("md_code_block", idx(body_start), idx(body_end))
-
-        # Blocs Quarto ::: ... :::
-        for m in re.finditer(r"(?ms)^:::+.*?$.*?^:::+\s*$", content):
-            self.text.tag_add("md_quarto", idx(m.start()), idx(m.end()))
+        # et blocs Quarto ::: ... :::, en un passage ligne par ligne.
+        # Comme en Markdown, une fence ``` n'est reconnue qu'en début de ligne.
+        fence_start = 0 if in_fence else None   # début de la ligne d'ouverture du bloc de code en cours
+        fence_body = 0          # début du contenu (après la ligne d'ouverture)
+        fence_quarto = False
+        div_start = None
+        pos = 0
+        for line in content.split("\n"):
+            end = pos + len(line)
+            if line.startswith("```"):
+                if fence_start is None:
+                    fence_start, fence_body, fence_quarto = pos, min(end + 1, len(content)), "{" in line
+                else:
+                    # Ligne d'ouverture absente si le bloc commence avant `content`
+                    if fence_body > fence_start:
+                        add("md_code_fence", fence_start, fence_body)
+                    # Marquer Quarto {..}
+                    if fence_quarto:
+                        add("md_quarto", fence_start, fence_body)
+                    add("md_code_block", fence_body, pos)
+                    add("md_code_fence", pos, end)
+                    code_ranges.append((fence_start, end))
+                    fence_start = None
+            elif fence_start is None and line.startswith(":::"):
+                if div_start is None:
+                    div_start = pos
+                elif not line.rstrip().strip(":"):
+                    add("md_quarto", div_start, end)
+                    div_start = None
+            elif fence_start is None:
+                # Règles horizontales: lignes de --- ___ ***
+                stripped = line.rstrip()
+                if len(stripped) >= 3 and stripped[0] in "-_*" and stripped.count(stripped[0]) == len(stripped):
+                    add("md_hr", pos, end)
+            pos = end + 1
 
         # Inline code: `...` (non greedy), ignorer ``` blocs déjà tagués
-        for m in re.finditer(r"(?s)(?<!`)`([^`\n]|``(?!`))*?`", content):
-            self.text.tag_add("md_code_inline", idx(m.start()), idx(m.end()))
+        for m in _MD_PATTERNS["code_inline"].finditer(content):
+            add("md_code_inline", m.start(), m.end())
+            code_ranges.append((m.start(), m.end()))
 
-        # Gras : **texte** ou __texte__
-        for m in re.finditer(r"(?s)(\*\*|__)[^\n].*?\1", content):
-            self.text.tag_add("md_bold", idx(m.start()), idx(m.end()))
-
-        # Italique : *texte* ou _texte_ (éviter de capturer le gras déjà tagué)
-        for m in re.finditer(r"(?s)(?<!\*)\*(?!\*)([^*\n]|\*(?=[^*\n]))*?\*(?<!\*)|(?<!_)_(?!_)([^_\n]|_(?=[^_\n]))*?_(?<!_)", content):
-            self.text.tag_add("md_italic", idx(m.start()), idx(m.end()))
+        # Gras (**texte**, __texte__) et italique (*texte*, _texte_), hors code
+        for tag, start, end in _tokenize_emphasis(content, code_ranges):
+            add(tag, start, end)
 
         # Liens : [texte](url) basique
-        for m in re.finditer(r"\[([^\]]+)\]\(([^)]+)\)", content):
-            self.text.tag_add("md_link", idx(m.start()), idx(m.end()))
+        for m in _MD_PATTERNS["link"].finditer(content):
+            add("md_link", m.start(), m.end())
 
         # Titres Setext (=== ou --- sous la ligne)
-        for m in re.finditer(r"(?ms)^(?P<title>[^\n]+)\n(=+|-+)\s*$", content):
-            self.text.tag_add("md_heading", idx(m.start("title")), idx(m.end("title")))
+        for m in _MD_PATTERNS["setext"].finditer(content):
+            add("md_heading", m.start("title"), m.end("title"))
+
+        for tag, indices in ranges.items():
+            self.text.tag_add(tag, *indices)
+
+    def _schedule_viewport_highlighting(self):
+        if self._md_viewport_job is not None:
+            self.after_cancel(self._md_viewport_job)
+        self._md_viewport_job = self.after(100, self._highlight_viewport)
+
+    def _highlight_viewport(self):
+        self._md_viewport_job = None
+        if not self._md_viewport_mode:
+            return
+        first = int(self.text.index("@0,0").split(".")[0])
+        last = int(self.text.index(f"@0,{self.text.winfo_height()}").split(".")[0])
+        if (first, last) == self._md_viewport_range:
+            return
+        self._md_viewport_range = (first, last)
+        # Les lignes ``` au-dessus de la zone visible disent si elle commence dans un bloc de code
+        above = self.text.get("1.0", f"{first}.0")
+        fences_above = above.count("\n```") + above.startswith("```")
+        content = self.text.get(f"{first}.0", f"{last}.end")
+        self._apply_markdown_highlighting(content, first, in_fence=fences_above % 2 == 1)
 
     # --- Méthodes diverses
     def _start_progress(self):
         if not self.prog_running:
             self.prog.start(10)
             self.prog_running = True
-        self.run_btn.config(state="disabled")
-        self.stop_btn.config(state="normal")
 
     def _stop_progress(self):
         if self.prog_running:
             self.prog.stop()
             self.prog_running = False
-        self.run_btn.config(state="normal")
-        self.stop_btn.config(state="disabled")
 
-    def _refresh_list(self):
+    @staticmethod
+    def _list_label(item: CommandItem) -> str:
+        suffix = "  📄" if item.file else ""
+        return item.label + suffix
+
+    def _full_refresh(self):
         self.listbox.delete(0, tk.END)
-        for item in self.model.items:
-            suffix = "  📄" if item.file else ""
-            self.listbox.insert(tk.END, item.label + suffix)
         if self.model.items:
+            self.listbox.insert(tk.END, *(self._list_label(item) for item in self.model.items))
             self.listbox.select_set(0)
 
+    def _refresh_one(self, idx: int):
+        self.listbox.delete(idx)
+        self.listbox.insert(idx, self._list_label(self.model.items[idx]))
+        self._select_index(idx)
+
+    def _remove_one(self, idx: int):
+        self.listbox.delete(idx)
+        if self.model.items:
+            self._select_index(min(idx, len(self.model.items) - 1))
+
+    def _append_one(self):
+        self.listbox.insert(tk.END, self._list_label(self.model.items[-1]))
+        self._select_index(len(self.model.items) - 1)
+
+    def _select_index(self, idx: int):
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(idx)
+        self.listbox.activate(idx)
+        self.listbox.see(idx)
+
     def _sync_text_scroll(self, first, last):
         """Keep the line number panel aligned with the text widget."""
         self.line_numbers.yview_moveto(first)
+        if self._md_viewport_mode:
+            self._schedule_viewport_highlighting()
 
     def _on_text_modified(self, _event=None):
         if self.text.edit_modified():
             self.text.edit_modified(False)
-            self._update_line_numbers()
+            # Regrouper les mises à jour de la numérotation au prochain passage idle
+            if not self._lineno_pending:
+                self._lineno_pending = True
+                self.after_idle(self._update_line_numbers)
 
     def _on_line_numbers_mousewheel(self, event):
         direction = 0
@@ -463,13 +766,26 @@ class App(ttk.Frame):
         return "break"
 
     def _update_line_numbers(self):
+        self._lineno_pending = False
         line_count = int(self.text.index("end-1c").split(".")[0])
-        width = max(3, len(str(line_count)))
-        numbers = "\n".join(f"{i:>{width}}" for i in range(1, line_count + 1)) or "1"
+        if line_count != self._last_line_count:
+            self._write_line_numbers(self._last_line_count, line_count)
+
+    def _write_line_numbers(self, old: int, new: int):
+        """Passe la numérotation de `old` à `new` lignes, en ajout/retrait de fin si la largeur ne change pas."""
+        width = max(3, len(str(new)))
         self.line_numbers.config(state="normal")
-        self.line_numbers.delete("1.0", tk.END)
-        self.line_numbers.insert("1.0", numbers + "\n")
+        if old and width == max(3, len(str(old))):
+            if new > old:
+                self.line_numbers.insert("end-1c", "".join(f"{i:>{width}}\n" for i in range(old + 1, new + 1)))
+            else:
+                self.line_numbers.delete(f"{new + 1}.0", f"{old + 1}.0")
+        else:
+            self.line_numbers.delete("1.0", tk.END)
+            self.line_numbers.insert("1.0", "".join(f"{i:>{width}}\n" for i in range(1, new + 1)))
         self.line_numbers.config(state="disabled", width=max(4, width + 1))
+        self.line_numbers.yview_moveto(self.text.yview()[0])
+        self._last_line_count = new
 
     def _set_output_file(self, path: Path | str | None):
         if path:
@@ -486,6 +802,18 @@ class App(ttk.Frame):
 
     def append_output(self, text):
         self.text.insert(tk.END, text)
+        # Un seul défilement vers la fin par passage idle, quel que soit le nombre de blocs
+        if not self._see_pending:
+            self._see_pending = True
+            self.after_idle(self._see_end)
+        # Ajout en fin : numérotation étendue d'autant de lignes, sans recompter
+        # le widget (la mise à jour idle corrige au besoin si une est en attente)
+        added = text.count("\n")
+        if added and not self._lineno_pending:
+            self._write_line_numbers(self._last_line_count, self._last_line_count + added)
+
+    def _see_end(self):
+        self._see_pending = False
         self.text.see(tk.END)
 
     def set_status(self, msg: str | None = None):
@@ -494,6 +822,12 @@ class App(ttk.Frame):
         if running:
             base += "  |  Exécution en cours…"
 
+        # États des widgets inchangés : seul le texte de statut est mis à jour
+        if running == self._last_running_state and msg is None:
+            self.status.config(text=base)
+            return
+        self._last_running_state = running
+
         # Activer/désactiver la liste et menus
         state = "disabled" if running else "normal"
         self.listbox.config(state=state)
@@ -517,9 +851,11 @@ class App(ttk.Frame):
             return
         cmd = self.model.items[idx].command
         self._set_output_file(None)
+        self._md_viewport_mode = False
         self.text.delete("1.0", tk.END)
         try:
-            self.runner.run(cmd, self.cwd_var.get() or None)
+            if not self.runner.run(cmd, self.cwd_var.get() or None):
+                return
             self._start_progress()
             self.set_status()
         except RuntimeError as e:
@@ -552,13 +888,26 @@ class App(ttk.Frame):
         if path:
             self.cwd_var.set(path)
             self.model.cwd = path
-            self.model.save()
+            self._save_model()
             self.set_status()
 
     def save(self):
         self.model.cwd = self.cwd_var.get() or None
-        self.model.save()
-        self.set_status("Enregistré ✔")
+        self._save_model("Enregistré ✔")
+
+    def _save_model(self, success_msg: str | None = None):
+        self._watch_save(self.model.save(), success_msg)
+
+    def _watch_save(self, seq: int, success_msg: str | None = None):
+        """Attend la fin de l'écriture en arrière-plan, puis signale erreur ou succès."""
+        if not self.model.is_saved(seq):
+            self.after(50, self._watch_save, seq, success_msg)
+            return
+        err = self.model.take_save_error()
+        if err is not None:
+            messagebox.showerror(APP_TITLE, f"Impossible d'enregistrer {CONFIG_FILE}: {err}")
+        elif success_msg:
+            self.set_status(success_msg)
 
     def save_opened_output_file(self):
         if not self._opened_file_path:
@@ -577,6 +926,7 @@ class App(ttk.Frame):
             messagebox.showinfo(APP_TITLE, "Aucun fichier ouvert à fermer.")
             return
         closed = self._opened_file_path
+        self._md_viewport_mode = False
         self.text.delete("1.0", tk.END)
         self.text.edit_modified(False)
         self._set_output_file(None)
@@ -616,52 +966,74 @@ class App(ttk.Frame):
         item = self.model.items[idx]
         if messagebox.askyesno(APP_TITLE, f"Supprimer ‘{item.label}’ ?"):
             del self.model.items[idx]
-            self.model.save()
-            self._refresh_list()
+            self._save_model()
+            self._remove_one(idx)
 
     def _open_edit_dialog(self, title: str, idx: int | None = None):
-        dialog = tk.Toplevel(self)
+        # Dialogue construit une seule fois, puis masqué / réaffiché
+        if self._edit_dialog is None:
+            self._build_edit_dialog()
+        item = self.model.items[idx] if idx is not None else None
+        self._edit_idx = idx
+        self._edit_label_var.set(item.label if item else "")
+        self._edit_cmd_var.set(item.command if item else "")
+        self._edit_file_var.set((item.file or "") if item else "")
+
+        dialog = self._edit_dialog
         dialog.title(title)
-        dialog.transient(self)
+        dialog.deiconify()
         dialog.grab_set()
+        self._edit_label_entry.focus_set()
+
+    def _build_edit_dialog(self):
+        dialog = tk.Toplevel(self)
+        dialog.withdraw()
+        dialog.transient(self)
+        dialog.protocol("WM_DELETE_WINDOW", self._close_edit_dialog)
 
         ttk.Label(dialog, text="Libellé:").grid(row=0, column=0, sticky="e", padx=6, pady=6)
-        label_var = tk.StringVar(value=self.model.items[idx].label if idx is not None else "")
-        label_entry = ttk.Entry(dialog, textvariable=label_var, width=50)
-        label_entry.grid(row=0, column=1, padx=6, pady=6)
+        self._edit_label_var = tk.StringVar()
+        self._edit_label_entry = ttk.Entry(dialog, textvariable=self._edit_label_var, width=50)
+        self._edit_label_entry.grid(row=0, column=1, padx=6, pady=6)
 
         ttk.Label(dialog, text="Commande PowerShell:").grid(row=1, column=0, sticky="e", padx=6, pady=6)
-        cmd_var = tk.StringVar(value=self.model.items[idx].command if idx is not None else "")
-        cmd_entry = ttk.Entry(dialog, textvariable=cmd_var, width=50)
+        self._edit_cmd_var = tk.StringVar()
+        cmd_entry = ttk.Entry(dialog, textvariable=self._edit_cmd_var, width=50)
         cmd_entry.grid(row=1, column=1, padx=6, pady=6)
 
         ttk.Label(dialog, text="Fichier associé (optionnel):").grid(row=2, column=0, sticky="e", padx=6, pady=6)
-        file_var = tk.StringVar(value=self.model.items[idx].file if idx is not None else "")
-        file_entry = ttk.Entry(dialog, textvariable=file_var, width=40)
+        self._edit_file_var = tk.StringVar()
+        file_entry = ttk.Entry(dialog, textvariable=self._edit_file_var, width=40)
         file_entry.grid(row=2, column=1, padx=6, pady=6)
-        ttk.Button(dialog, text="Parcourir…", command=lambda: self._browse_file_into(file_var)).grid(row=2, column=2, padx=6, pady=6)
-
-        def on_ok():
-            label = label_var.get().strip()
-            cmd = cmd_var.get().strip()
-            filev = file_var.get().strip() or None
-            if not label or not cmd:
-                messagebox.showwarning(APP_TITLE, "Veuillez renseigner le libellé et la commande.")
-                return
-            item = CommandItem(label=label, command=cmd, file=filev)
-            if idx is None:
-                self.model.items.append(item)
-            else:
-                self.model.items[idx] = item
-            self.model.save()
-            self._refresh_list()
-            dialog.destroy()
+        ttk.Button(dialog, text="Parcourir…", command=lambda: self._browse_file_into(self._edit_file_var)).grid(row=2, column=2, padx=6, pady=6)
+
+        ttk.Button(dialog, text="OK", command=self._on_edit_dialog_ok).grid(row=3, column=2, sticky="e", padx=6, pady=10)
+        ttk.Button(dialog, text="Annuler", command=self._close_edit_dialog).grid(row=3, column=1, sticky="w", padx=6, pady=10)
+        dialog.bind("<Return>", lambda e: self._on_edit_dialog_ok())
+        dialog.bind("<Escape>", lambda e: self._close_edit_dialog())
+        self._edit_dialog = dialog
+
+    def _on_edit_dialog_ok(self):
+        label = self._edit_label_var.get().strip()
+        cmd = self._edit_cmd_var.get().strip()
+        filev = self._edit_file_var.get().strip() or None
+        if not label or not cmd:
+            messagebox.showwarning(APP_TITLE, "Veuillez renseigner le libellé et la commande.")
+            return
+        item = CommandItem(label=label, command=cmd, file=filev)
+        if self._edit_idx is None:
+            self.model.items.append(item)
+            self._save_model()
+            self._append_one()
+        else:
+            self.model.items[self._edit_idx] = item
+            self._save_model()
+            self._refresh_one(self._edit_idx)
+        self._close_edit_dialog()
 
-        ttk.Button(dialog, text="OK", command=on_ok).grid(row=3, column=2, sticky="e", padx=6, pady=10)
-        ttk.Button(dialog, text="Annuler", command=dialog.destroy).grid(row=3, column=1, sticky="w", padx=6, pady=10)
-        dialog.bind("<Return>", lambda e: on_ok())
-        dialog.bind("<Escape>", lambda e: dialog.destroy())
-        label_entry.focus_set()
+    def _close_edit_dialog(self):
+        self._edit_dialog.grab_release()
+        self._edit_dialog.withdraw()
 
     def _browse_file_into(self, var: tk.StringVar):
         initialdir = self.cwd_var.get() or str(Path.cwd())
@@ -688,3 +1060,7 @@ if __name__ == "__main__":
     model.load()
     app = App(root, model)
     root.mainloop()
+    model.flush()
+    err = model.take_save_error()
+    if err is not None:
+        messagebox.showerror(APP_TITLE, f"Impossible d'enregistrer {CONFIG_FILE}: {err}")